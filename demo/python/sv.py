@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""Average several slowly varying analog inputs
+
+This example uses the `comedi_sv_multi_*()` functions to read
+`N_SAMPLES` samples from each of several analog input channels and
+print the mean, standard deviation, minimum and maximum of each
+channel in physical units.
+"""
+
+import logging as _logging
+
+import comedi as _comedi
+
+
+LOG = _logging.getLogger('comedi-sv')
+LOG.addHandler(_logging.StreamHandler())
+LOG.setLevel(_logging.ERROR)
+
+
+class MultiVoltmeter (object):
+    """Wrap a `comedi_sv_multi_t` and its result arrays
+
+    The result arrays are allocated once and reused by every call to
+    `measure()`.
+    """
+    def __init__(self, device, subdevice, channels, range, aref, n_samples,
+                 calibration=None):
+        self.n_chan = len(channels)
+        chanlist = _comedi.chanlist(self.n_chan)
+        for i,channel in enumerate(channels):
+            chanlist[i] = _comedi.cr_pack(channel, range, aref)
+        self.sv = _comedi.comedi_sv_multi_alloc(
+            device, subdevice, chanlist, self.n_chan, n_samples)
+        if not self.sv:
+            raise Exception('error allocating voltmeter ({})'.format(
+                    _comedi.comedi_strerror(_comedi.comedi_errno())))
+        if calibration is not None:
+            ret = _comedi.comedi_sv_multi_apply_softcal(self.sv, calibration)
+            if ret < 0:
+                raise Exception('error applying software calibration')
+        self._mean = _comedi.double_array(self.n_chan)
+        self._stddev = _comedi.double_array(self.n_chan)
+        self._min = _comedi.double_array(self.n_chan)
+        self._max = _comedi.double_array(self.n_chan)
+
+    def measure(self):
+        """Return `(mean, stddev, min, max)` lists, one entry per channel
+        """
+        ret = _comedi.comedi_sv_multi_measure(
+            self.sv, self._mean, self._stddev, self._min, self._max)
+        if ret < 0:
+            raise Exception('error measuring ({})'.format(
+                    _comedi.comedi_strerror(_comedi.comedi_errno())))
+        return tuple(
+            [array[i] for i in range(self.n_chan)]
+            for array in [self._mean, self._stddev, self._min, self._max])
+
+    def close(self):
+        if self.sv:
+            _comedi.comedi_sv_multi_free(self.sv)
+            self.sv = None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-f', '--filename', default='/dev/comedi0',
+        help='path to comedi device file')
+    parser.add_argument(
+        '-s', '--subdevice', type=int, help='subdevice for analog input')
+    parser.add_argument(
+        '-c', '--channels', type=int, nargs='+', default=[0],
+        help='channels for analog input')
+    parser.add_argument(
+        '-a', '--analog-reference', dest='aref', default='ground',
+        choices=['diff', 'ground', 'other', 'common'],
+        help='reference for analog input')
+    parser.add_argument(
+        '-r', '--range', type=int, default=0, help='range for analog input')
+    parser.add_argument(
+        '-N', '--num-samples', type=int, default=100,
+        help='number of samples to average per channel')
+    parser.add_argument(
+        '-v', '--verbose', default=0, action='count')
+
+    args = parser.parse_args()
+
+    if args.verbose >= 3:
+        LOG.setLevel(_logging.DEBUG)
+    elif args.verbose >= 2:
+        LOG.setLevel(_logging.INFO)
+    elif args.verbose >= 1:
+        LOG.setLevel(_logging.WARN)
+
+    LOG.info(('measuring device={0.filename} subdevice={0.subdevice} '
+              'channels={0.channels} range={0.range} analog reference={0.aref}'
+              ).format(args))
+
+    device = _comedi.comedi_open(args.filename)
+    if not device:
+        raise Exception('error opening Comedi device {}'.format(
+                args.filename))
+
+    subdevice = args.subdevice
+    if subdevice is None:
+        subdevice = _comedi.comedi_find_subdevice_by_type(
+            device, _comedi.COMEDI_SUBD_AI, 0)
+        if subdevice < 0:
+            raise Exception('no analog input subdevice on {}'.format(
+                    args.filename))
+
+    calibration = None
+    flags = _comedi.comedi_get_subdevice_flags(device, subdevice)
+    if flags >= 0 and flags & _comedi.SDF_SOFT_CALIBRATED:
+        path = _comedi.comedi_get_default_calibration_path(device)
+        calibration = _comedi.comedi_parse_calibration_file(path)
+        if not calibration:
+            LOG.warn('no software calibration in {}'.format(path))
+            calibration = None
+
+    voltmeter = MultiVoltmeter(
+        device=device, subdevice=subdevice, channels=args.channels,
+        range=args.range,
+        aref=getattr(_comedi, 'AREF_{}'.format(args.aref.upper())),
+        n_samples=args.num_samples, calibration=calibration)
+    try:
+        mean, stddev, min, max = voltmeter.measure()
+    finally:
+        voltmeter.close()
+        if calibration is not None:
+            _comedi.comedi_cleanup_calibration(calibration)
+
+    ret = _comedi.comedi_close(device)
+    if ret != 0:
+        raise Exception('error closing Comedi device {} ({})'.format(
+                args.filename, ret))
+
+    print('channel\tmean\tstddev\tmin\tmax')
+    for i,channel in enumerate(args.channels):
+        print('{}\t{:g}\t{:g}\t{:g}\t{:g}'.format(
+                channel, mean[i], stddev[i], min[i], max[i]))
@@ -301,6 +301,18 @@ double comedi_to_physical(lsampl_t data,
 lsampl_t comedi_from_physical(double data,
 	const comedi_polynomial_t *conversion_polynomial);
 
+/* multi-channel slowly varying measurements */
+typedef struct comedi_sv_multi_struct comedi_sv_multi_t;
+comedi_sv_multi_t *comedi_sv_multi_alloc(comedi_t *dev, unsigned int subdevice,
+	const unsigned int *chanlist, unsigned int n_chan, unsigned int n);
+void comedi_sv_multi_free(comedi_sv_multi_t *it);
+int comedi_sv_multi_set_converter(comedi_sv_multi_t *it, unsigned int index,
+	const comedi_polynomial_t *converter);
+int comedi_sv_multi_apply_softcal(comedi_sv_multi_t *it,
+	const comedi_calibration_t *calibration);
+int comedi_sv_multi_measure(comedi_sv_multi_t *it, double *mean,
+	double *stddev, double *min, double *max);
+
 int comedi_internal_trigger(comedi_t *dev, unsigned subd, unsigned trignum);
 /* INSN_CONFIG wrappers */
 int comedi_arm(comedi_t *device, unsigned subdevice, unsigned source);
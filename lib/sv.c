@@ -36,9 +36,6 @@
 
 
 
-int sv_measure_l(comedi_sv_t *it,double *data);
-int sv_measure_s(comedi_sv_t *it,double *data);
-
 EXPORT_ALIAS_DEFAULT(_comedi_sv_init,comedi_sv_init,0.7.18);
 int _comedi_sv_init(comedi_sv_t *it,comedi_t *dev,unsigned int subd,unsigned int chan)
 {
@@ -69,131 +66,314 @@ int _comedi_sv_update(comedi_sv_t *it)
 	return 0;
 }
 
+/* samples read per channel and per instruction, as in comedi_data_read_n() */
+#define SV_MAX_CHUNK_SIZE 100
+
 EXPORT_ALIAS_DEFAULT(_comedi_sv_measure,comedi_sv_measure,0.7.18);
 int _comedi_sv_measure(comedi_sv_t *it,double *data)
 {
-	if(!it)return -1;
-	if(!valid_subd(it->dev,it->subdevice))return -1;
-	if(it->dev->subdevices[it->subdevice].subd_flags & SDF_LSAMPL){
-		return sv_measure_l(it,data);
-	}else{
-		return sv_measure_s(it,data);
-	}
-}
-
-int sv_measure_l(comedi_sv_t *it,double *data)
-{
-	comedi_trig t;
-	int ret=0;
-	lsampl_t *val;
-	unsigned int chan;
+	lsampl_t val[SV_MAX_CHUNK_SIZE];
 	comedi_range *rng;
+	unsigned int chunk_size;
 	double sum;
-	int i;
+	unsigned int i;
+	int ret;
 	int n;
 
-	val=malloc(sizeof(*val)*it->n);
-	if(!val){
-		libc_error();
+	if(!it)return -1;
+	if(!valid_chan(it->dev,it->subdevice,it->chan))return -1;
+	if(it->n<=0){
+		internal_error(EINVAL);
 		return -1;
 	}
 
-	chan=CR_PACK(it->chan,it->range,it->aref);
+	rng=comedi_get_range(it->dev,it->subdevice,it->chan,it->range);
 
-	t.subdev=it->subdevice;
-	t.mode=0;
-	t.flags=TRIG_DITHER;
-	t.n_chan=1;
-	t.chanlist=&chan;
-	t.trigsrc=0;
-	t.trigvar=0;
-	t.trigvar1=0;
+	sum=0;
+	for(n=0;n<it->n;n+=chunk_size){
+		chunk_size=it->n-n;
+		if(chunk_size>SV_MAX_CHUNK_SIZE)chunk_size=SV_MAX_CHUNK_SIZE;
 
-	rng=comedi_get_range(it->dev,it->subdevice,it->chan,it->range);
+		ret=comedi_data_read_n(it->dev,it->subdevice,it->chan,
+			it->range,it->aref,val,chunk_size);
+		if(ret<0)return ret;
 
-	for(n=0;n<it->n;){
-		t.data=(void *)(val+n);
-		t.n=it->n-n;
-		i = comedi_ioctl(it->dev->fd, COMEDI_TRIG, &t);
-		if(i<=0){
-			ret=i;
-			goto out;
+		for(i=0;i<chunk_size;i++){
+			sum+=comedi_to_phys(val[i],rng,it->maxdata);
 		}
-		n+=i;
-	}
-
-	sum=0;
-	for(i=0;i<it->n;i++){
-		sum+=comedi_to_phys(val[i],rng,it->maxdata);
 	}
 	*data=sum/it->n;
 
-out:
-	free(val);
-
-	return ret;
+	return 0;
 }
 
-/* yes, these functions are _almost_ exactly the same... */
+/* multi-channel slowly varying measurements */
+
+struct comedi_sv_multi_struct{
+	comedi_t *dev;
+	unsigned int subdevice;
+	unsigned int n_chan;
+
+	/* number of measurements to average per channel */
+	unsigned int n;
 
-int sv_measure_s(comedi_sv_t *it,double *data)
+	unsigned int *chanlist;
+	comedi_polynomial_t *converters;
+
+	/* one INSN_READ per channel, reused for every chunk */
+	comedi_insn *insns;
+	lsampl_t *raw;
+	double *phys;
+
+	/* per-channel accumulators */
+	double *shift;
+	double *sum;
+	double *sumsq;
+	double *min;
+	double *max;
+};
+
+EXPORT_ALIAS_DEFAULT(_comedi_sv_multi_free,comedi_sv_multi_free,0.12.0);
+void _comedi_sv_multi_free(comedi_sv_multi_t *it)
 {
-	comedi_trig t;
-	int ret=0;
-	sampl_t *val;
-	unsigned int chan;
-	comedi_range *rng;
-	double sum;
-	int i;
-	int n;
+	if(!it)return;
+
+	free(it->chanlist);
+	free(it->converters);
+	free(it->insns);
+	free(it->raw);
+	free(it->phys);
+	free(it->shift);
+	free(it->sum);
+	free(it->sumsq);
+	free(it->min);
+	free(it->max);
+	free(it);
+}
 
-	val=malloc(sizeof(*val)*it->n);
-	if(!val){
+EXPORT_ALIAS_DEFAULT(_comedi_sv_multi_alloc,comedi_sv_multi_alloc,0.12.0);
+comedi_sv_multi_t *_comedi_sv_multi_alloc(comedi_t *dev,unsigned int subd,
+	const unsigned int *chanlist,unsigned int n_chan,unsigned int n)
+{
+	comedi_sv_multi_t *it;
+	unsigned int i;
+
+	if(!valid_subd(dev,subd))return NULL;
+	if(!chanlist || n_chan==0 || n==0){
+		internal_error(EINVAL);
+		return NULL;
+	}
+	for(i=0;i<n_chan;i++){
+		if(!valid_chan(dev,subd,CR_CHAN(chanlist[i])))return NULL;
+	}
+
+	it=calloc(1,sizeof(*it));
+	if(!it){
 		libc_error();
-		return -1;
+		return NULL;
 	}
 
-	chan=CR_PACK(it->chan,it->range,it->aref);
+	it->dev=dev;
+	it->subdevice=subd;
+	it->n_chan=n_chan;
+	it->n=n;
+
+	it->chanlist=malloc(sizeof(*it->chanlist)*n_chan);
+	it->converters=malloc(sizeof(*it->converters)*n_chan);
+	it->insns=calloc(n_chan,sizeof(*it->insns));
+	it->raw=calloc(n_chan*SV_MAX_CHUNK_SIZE,sizeof(*it->raw));
+	it->phys=malloc(sizeof(*it->phys)*SV_MAX_CHUNK_SIZE);
+	it->shift=malloc(sizeof(*it->shift)*n_chan);
+	it->sum=malloc(sizeof(*it->sum)*n_chan);
+	it->sumsq=malloc(sizeof(*it->sumsq)*n_chan);
+	it->min=malloc(sizeof(*it->min)*n_chan);
+	it->max=malloc(sizeof(*it->max)*n_chan);
+	if(!it->chanlist || !it->converters || !it->insns || !it->raw ||
+		!it->phys || !it->shift || !it->sum || !it->sumsq ||
+		!it->min || !it->max){
+		libc_error();
+		comedi_sv_multi_free(it);
+		return NULL;
+	}
 
-	t.subdev=it->subdevice;
-	t.mode=0;
-	t.flags=TRIG_DITHER;
-	t.n_chan=1;
-	t.chanlist=&chan;
-	t.data=val;
-	t.n=it->n;
-	t.trigsrc=0;
-	t.trigvar=0;
-	t.trigvar1=0;
+	memcpy(it->chanlist,chanlist,sizeof(*it->chanlist)*n_chan);
 
-	rng=comedi_get_range(it->dev,it->subdevice,it->chan,it->range);
+	for(i=0;i<n_chan;i++){
+		if(comedi_get_hardcal_converter(dev,subd,CR_CHAN(chanlist[i]),
+			CR_RANGE(chanlist[i]),COMEDI_TO_PHYSICAL,
+			&it->converters[i])<0){
+			comedi_sv_multi_free(it);
+			return NULL;
+		}
 
-	for(n=0;n<it->n;){
-		t.data=val+n;
-		t.n=it->n-n;
-		i = comedi_ioctl(it->dev->fd, COMEDI_TRIG, &t);
-		if(i<=0){
-			ret=i;
-			goto out;
+		it->insns[i].insn=INSN_READ;
+		it->insns[i].subdev=subd;
+		it->insns[i].chanspec=chanlist[i];
+		it->insns[i].data=it->raw+i*SV_MAX_CHUNK_SIZE;
+	}
+
+	return it;
+}
+
+EXPORT_ALIAS_DEFAULT(_comedi_sv_multi_set_converter,comedi_sv_multi_set_converter,0.12.0);
+int _comedi_sv_multi_set_converter(comedi_sv_multi_t *it,unsigned int index,
+	const comedi_polynomial_t *converter)
+{
+	if(!it || !converter)return -1;
+	if(index>=it->n_chan ||
+		converter->order>=COMEDI_MAX_NUM_POLYNOMIAL_COEFFICIENTS){
+		internal_error(EINVAL);
+		return -1;
+	}
+
+	it->converters[index]=*converter;
+
+	return 0;
+}
+
+EXPORT_ALIAS_DEFAULT(_comedi_sv_multi_apply_softcal,comedi_sv_multi_apply_softcal,0.12.0);
+int _comedi_sv_multi_apply_softcal(comedi_sv_multi_t *it,
+	const comedi_calibration_t *calibration)
+{
+	comedi_polynomial_t converter;
+	unsigned int i;
+
+	if(!it || !calibration)return -1;
+
+	/* only switch over once every channel has a software calibration */
+	for(i=0;i<it->n_chan;i++){
+		if(comedi_get_softcal_converter(it->subdevice,
+			CR_CHAN(it->chanlist[i]),CR_RANGE(it->chanlist[i]),
+			COMEDI_TO_PHYSICAL,calibration,&converter)<0){
+			internal_error(EINVAL);
+			return -1;
 		}
-		n+=i;
+	}
+	for(i=0;i<it->n_chan;i++){
+		comedi_get_softcal_converter(it->subdevice,
+			CR_CHAN(it->chanlist[i]),CR_RANGE(it->chanlist[i]),
+			COMEDI_TO_PHYSICAL,calibration,&it->converters[i]);
 	}
 
-	sum=0;
-	for(i=0;i<it->n;i++){
-		sum+=comedi_to_phys(val[i],rng,it->maxdata);
+	return 0;
+}
+
+/* Evaluate the conversion polynomial over a whole chunk at once.  The
+ * linear case covers every hardware-calibrated subdevice and is kept
+ * free of inner loops so the compiler can vectorize it. */
+static void sv_multi_convert(const comedi_polynomial_t *p,
+	const lsampl_t *src,double *dest,unsigned int n)
+{
+	const double origin=p->expansion_origin;
+	unsigned int i;
+	unsigned int j;
+
+	if(p->order==1){
+		const double c0=p->coefficients[0];
+		const double c1=p->coefficients[1];
+
+		for(i=0;i<n;i++){
+			dest[i]=c0+c1*(src[i]-origin);
+		}
+		return;
 	}
-	*data=sum/it->n;
 
-out:
-	free(val);
+	for(i=0;i<n;i++){
+		double x=src[i]-origin;
+		double value=p->coefficients[p->order];
 
-	return ret;
+		for(j=p->order;j>0;j--){
+			value=value*x+p->coefficients[j-1];
+		}
+		dest[i]=value;
+	}
 }
 
+EXPORT_ALIAS_DEFAULT(_comedi_sv_multi_measure,comedi_sv_multi_measure,0.12.0);
+int _comedi_sv_multi_measure(comedi_sv_multi_t *it,double *mean,
+	double *stddev,double *min,double *max)
+{
+	comedi_insnlist il;
+	unsigned int chunk_size;
+	unsigned int n;
+	unsigned int i;
+	unsigned int j;
+	int ret;
 
+	if(!it)return -1;
 
+	il.n_insns=it->n_chan;
+	il.insns=it->insns;
 
+	for(n=0;n<it->n;n+=chunk_size){
+		chunk_size=it->n-n;
+		if(chunk_size>SV_MAX_CHUNK_SIZE)chunk_size=SV_MAX_CHUNK_SIZE;
 
+		for(i=0;i<it->n_chan;i++){
+			it->insns[i].n=chunk_size;
+		}
 
+		ret=comedi_do_insnlist(it->dev,&il);
+		if(ret<0)return ret;
+		if((unsigned int)ret!=it->n_chan){
+			internal_error(EIO);
+			return -1;
+		}
 
+		for(i=0;i<it->n_chan;i++){
+			const double *phys=it->phys;
+			double shift;
+			double sum=0;
+			double sumsq=0;
+			double lo;
+			double hi;
+
+			sv_multi_convert(&it->converters[i],
+				it->raw+i*SV_MAX_CHUNK_SIZE,it->phys,chunk_size);
+
+			/* accumulate relative to the first sample to keep the
+			 * variance from cancelling out */
+			if(n==0){
+				it->shift[i]=phys[0];
+				it->sum[i]=0;
+				it->sumsq[i]=0;
+				it->min[i]=phys[0];
+				it->max[i]=phys[0];
+			}
+			shift=it->shift[i];
+			lo=it->min[i];
+			hi=it->max[i];
+			for(j=0;j<chunk_size;j++){
+				double d=phys[j]-shift;
+
+				sum+=d;
+				sumsq+=d*d;
+				if(phys[j]<lo)lo=phys[j];
+				if(phys[j]>hi)hi=phys[j];
+			}
+			it->sum[i]+=sum;
+			it->sumsq[i]+=sumsq;
+			it->min[i]=lo;
+			it->max[i]=hi;
+		}
+	}
+
+	for(i=0;i<it->n_chan;i++){
+		double d=it->sum[i]/it->n;
+
+		if(mean)mean[i]=it->shift[i]+d;
+		if(stddev){
+			if(it->n>1){
+				double var=(it->sumsq[i]-it->sum[i]*d)/(it->n-1);
+
+				stddev[i]=var>0?sqrt(var):0;
+			}else{
+				stddev[i]=0;
+			}
+		}
+		if(min)min[i]=it->min[i];
+		if(max)max[i]=it->max[i];
+	}
+
+	return 0;
+}
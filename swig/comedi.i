@@ -112,6 +112,7 @@ unsigned int NI_AO_SCAN_BEGIN_SRC_RTSI(unsigned int rtsi_channel);
 %array_class(sampl_t, sampl_array);
 %array_class(lsampl_t, lsampl_array);
 %array_class(comedi_insn, insn_array);
+%array_class(double, double_array);
 
 #ifdef SWIGPYTHONONLYSHORT
 %insert("python") %{
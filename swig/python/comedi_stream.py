@@ -0,0 +1,889 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Stream Comedi acquisitions to remote clients
+
+The server owns one or more Comedi devices and listens on TCP and/or
+Unix sockets.  A client connects and sends one JSON line describing
+the command it wants (see `CommandSpec`).  The server answers with one
+JSON line (see `StreamServer`) and then streams binary frames.  Each
+frame starts with a `FRAME_HEADER` holding the frame flags, the
+sequence number of its first scan, the number of scans and the number
+of payload bytes, followed by the samples in scan order.
+
+Clients asking for the same continuous command on the same device
+share one acquisition, so a device can feed many clients.  Commands
+with a finite number of scans are not shared; the device is busy until
+they finish.  Raw payloads are sent as slices of the buffer read from
+the device, without a copy per client.  Frames are dropped for clients
+that fall too far behind; they can spot the gap from the scan sequence
+numbers.
+
+Physical values are computed once per frame with the per-channel
+conversion polynomials, using the software calibration on
+soft-calibrated subdevices.  The conversion is vectorized with numpy
+when it is installed.  Without numpy it runs in pure Python on the
+event loop, which limits physical streams to roughly `PURE_PYTHON_RATE`
+samples per second; raw streams are not affected.
+
+Pass `--simulate` to the server to serve a synthetic device, which is
+handy for trying clients over loopback without hardware.  The
+`comedi_test` driver can be used the same way through its device file.
+"""
+
+import array as _array
+import asyncio as _asyncio
+import collections as _collections
+import json as _json
+import logging as _logging
+import math as _math
+import os as _os
+import struct as _struct
+import sys as _sys
+
+try:
+    import numpy as _numpy
+except ImportError:
+    _numpy = None
+
+
+LOG = _logging.getLogger('comedi-stream')
+LOG.addHandler(_logging.StreamHandler())
+LOG.setLevel(_logging.ERROR)
+
+PROTOCOL_VERSION = 1
+MAGIC = b'CMDS'
+# magic, protocol version, flags, first scan, number of scans, payload bytes
+FRAME_HEADER = _struct.Struct('<4sHHQII')
+FLAG_PHYSICAL = 0x1
+FLAG_END = 0x2
+FLAG_ERROR = 0x4
+
+# frames are dropped for a client once this much data is queued for it
+MAX_CLIENT_BACKLOG = 4 * 1024 * 1024
+READ_SIZE = 64 * 1024
+# physical samples/s the pure-Python conversion sustains next to the
+# rest of the event loop (cubic calibrations convert at about twice this)
+PURE_PYTHON_RATE = 1000000
+SIMULATED_PERIOD = 0.05
+
+
+class StreamError (Exception):
+    pass
+
+
+def _linear_polynomial(lo, hi, maxdata):
+    """Return the `(coefficients, expansion_origin)` of a range
+
+    This is the conversion `comedi_get_hardcal_converter()` builds.
+    """
+    return ((lo, (hi - lo) / maxdata), 0.0)
+
+
+class CommandSpec (object):
+    """Description of an acquisition requested by a client
+
+    `chanlist` is a list of `(channel, range, aref)` tuples, `rate` is
+    the scan rate in Hz and `n_scans` is the number of scans to
+    acquire, or `None` to acquire until the last client leaves.  Only
+    continuous acquisitions are shared between clients.  If
+    `physical` is true the samples are converted to physical units on
+    the server and sent as doubles.
+    """
+    def __init__(self, chanlist, rate, n_scans=None, physical=False,
+                 filename='/dev/comedi0', subdevice=None):
+        self.filename = filename
+        self.subdevice = subdevice
+        self.chanlist = [tuple(int(x) for x in chan) for chan in chanlist]
+        self.rate = float(rate)
+        self.n_scans = n_scans if n_scans is None else int(n_scans)
+        self.physical = bool(physical)
+        if not self.chanlist:
+            raise StreamError('empty chanlist')
+        for chan in self.chanlist:
+            if len(chan) != 3:
+                raise StreamError(
+                    'chanlist entries must be (channel, range, aref): {}'
+                    .format(chan))
+        if not (_math.isfinite(self.rate) and self.rate > 0):
+            raise StreamError('invalid rate {}'.format(self.rate))
+        if self.n_scans is not None and self.n_scans <= 0:
+            raise StreamError('invalid number of scans {}'.format(
+                    self.n_scans))
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.to_dict())
+
+    def key(self):
+        """Return what must match for two clients to share an acquisition
+
+        Only continuous (`n_scans is None`) acquisitions are shared.
+        """
+        return (self.filename, self.subdevice, tuple(self.chanlist),
+                self.rate, self.n_scans)
+
+    def to_dict(self):
+        return {
+            'filename': self.filename,
+            'subdevice': self.subdevice,
+            'chanlist': [list(chan) for chan in self.chanlist],
+            'rate': self.rate,
+            'n_scans': self.n_scans,
+            'physical': self.physical,
+            }
+
+    @classmethod
+    def from_dict(cls, d):
+        try:
+            return cls(**d)
+        except TypeError as e:
+            raise StreamError(str(e))
+
+
+class SimulatedSource (object):
+    """Synthetic 16-bit, +/-10 V device producing a sine per channel
+
+    Channel `c` carries a sine of frequency `c + 1` Hz, so the data
+    are predictable and easy to check on the client side.
+    """
+    typecode = 'H'
+    maxdata = 0xffff
+
+    def __init__(self, spec, loop):
+        self.spec = spec
+        self._loop = loop
+        self._handle = None
+        self._start = None
+        self._produced = 0
+        self.scan_rate = spec.rate
+        self.ranges = [(-10.0, 10.0)] * len(spec.chanlist)
+        self.polynomials = [
+            _linear_polynomial(lo, hi, self.maxdata) for lo,hi in self.ranges]
+
+    def start(self, on_data, on_end):
+        self._on_data = on_data
+        self._on_end = on_end
+        self._start = self._loop.time()
+        self._handle = self._loop.call_soon(self._tick)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        due = int((self._loop.time() - self._start) * self.scan_rate)
+        if self.spec.n_scans is not None:
+            due = min(due, self.spec.n_scans)
+        data = _array.array(self.typecode)
+        for scan in range(self._produced, due):
+            t = scan / self.scan_rate
+            for i in range(len(self.spec.chanlist)):
+                x = 0.5 + 0.45 * _math.sin(2 * _math.pi * (i + 1) * t)
+                data.append(int(x * self.maxdata))
+        self._produced = due
+        if data:
+            self._on_data(data.tobytes())
+        if self.spec.n_scans is not None and due >= self.spec.n_scans:
+            self._handle = None
+            self._on_end(None)
+        else:
+            self._handle = self._loop.call_later(
+                SIMULATED_PERIOD, self._tick)
+
+
+class ComediSource (object):
+    """Run a Comedi command and read it from the device file
+    """
+    def __init__(self, spec, loop):
+        # imported here so clients and the simulated source do not
+        # need the Comedi binding
+        import comedi as _comedi
+
+        self._comedi = _comedi
+        self.spec = spec
+        self._loop = loop
+        self._reading = False
+        self._pending = b''
+        self.device = _comedi.comedi_open(spec.filename)
+        if not self.device:
+            raise StreamError('error opening Comedi device {}'.format(
+                    spec.filename))
+        try:
+            self._setup()
+        except Exception:
+            _comedi.comedi_close(self.device)
+            raise
+
+    def _error(self, what):
+        return StreamError('{} on {}: {}'.format(
+                what, self.spec.filename,
+                self._comedi.comedi_strerror(self._comedi.comedi_errno())))
+
+    def _setup(self):
+        c = self._comedi
+        spec = self.spec
+        subdevice = spec.subdevice
+        if subdevice is None:
+            subdevice = c.comedi_get_read_subdevice(self.device)
+            if subdevice < 0:
+                raise self._error('no streaming input subdevice')
+        self.subdevice = subdevice
+
+        flags = c.comedi_get_subdevice_flags(self.device, subdevice)
+        if flags < 0:
+            raise self._error('error reading subdevice flags')
+        if flags & c.SDF_LSAMPL:
+            self.typecode = 'I'
+        else:
+            self.typecode = 'H'
+
+        n_chan = len(spec.chanlist)
+        self._scan_bytes = _array.array(self.typecode).itemsize * n_chan
+        self._read_size = max(READ_SIZE, 2 * self._scan_bytes)
+        self._chanlist = c.chanlist(n_chan)
+        self.ranges = []
+        maxdata = None
+        for i,(channel, rng, aref) in enumerate(spec.chanlist):
+            self._chanlist[i] = c.cr_pack(channel, rng, aref)
+            r = c.comedi_get_range(self.device, subdevice, channel, rng)
+            if not r:
+                raise self._error('invalid range {} for channel {}'.format(
+                        rng, channel))
+            self.ranges.append((r.min, r.max))
+            m = c.comedi_get_maxdata(self.device, subdevice, channel)
+            if maxdata is not None and m != maxdata:
+                raise StreamError('channels with different maxdata')
+            maxdata = m
+        self.maxdata = maxdata
+
+        calibration = None
+        if flags & c.SDF_SOFT_CALIBRATED:
+            path = c.comedi_get_default_calibration_path(self.device)
+            calibration = c.comedi_parse_calibration_file(path)
+            if not calibration:
+                LOG.warning('no software calibration in {}'.format(path))
+                calibration = None
+        try:
+            self.polynomials = [
+                self._polynomial(channel, rng, calibration)
+                for channel, rng, aref in spec.chanlist]
+        finally:
+            if calibration is not None:
+                c.comedi_cleanup_calibration(calibration)
+
+        cmd = c.comedi_cmd_struct()
+        period_ns = int(1e9 / spec.rate)
+        ret = c.comedi_get_cmd_generic_timed(
+            self.device, subdevice, cmd, n_chan, period_ns)
+        if ret < 0:
+            raise self._error('error preparing command')
+        cmd.chanlist = self._chanlist
+        cmd.chanlist_len = n_chan
+        cmd.scan_end_arg = n_chan
+        if spec.n_scans is None:
+            cmd.stop_src = c.TRIG_NONE
+            cmd.stop_arg = 0
+        else:
+            cmd.stop_src = c.TRIG_COUNT
+            cmd.stop_arg = spec.n_scans
+        for i in range(2):
+            ret = c.comedi_command_test(self.device, cmd)
+            if ret < 0:
+                raise self._error('error testing command')
+        if ret != 0:
+            raise StreamError('command rejected by {} (test returned {})'
+                              .format(spec.filename, ret))
+        self._cmd = cmd
+        if cmd.scan_begin_src == c.TRIG_TIMER and cmd.scan_begin_arg:
+            self.scan_rate = 1e9 / cmd.scan_begin_arg
+        else:
+            self.scan_rate = spec.rate
+
+    def _polynomial(self, channel, rng, calibration):
+        """Return the `(coefficients, expansion_origin)` to physical units
+
+        Uses the software calibration when `calibration` is given and
+        the hardware-calibrated range conversion otherwise.
+        """
+        c = self._comedi
+        polynomial = c.comedi_polynomial_t()
+        if calibration is not None:
+            ret = c.comedi_get_softcal_converter(
+                self.subdevice, channel, rng, c.COMEDI_TO_PHYSICAL,
+                calibration, polynomial)
+            if ret < 0:
+                raise StreamError(
+                    'no software calibration for channel {} range {} on {}'
+                    .format(channel, rng, self.spec.filename))
+        else:
+            ret = c.comedi_get_hardcal_converter(
+                self.device, self.subdevice, channel, rng,
+                c.COMEDI_TO_PHYSICAL, polynomial)
+            if ret < 0:
+                raise self._error(
+                    'error getting converter for channel {} range {}'.format(
+                        channel, rng))
+        coefficients = c.double_array.frompointer(polynomial.coefficients)
+        return (tuple(coefficients[i] for i in range(polynomial.order + 1)),
+                polynomial.expansion_origin)
+
+    def start(self, on_data, on_end):
+        self._on_data = on_data
+        self._on_end = on_end
+        ret = self._comedi.comedi_command(self.device, self._cmd)
+        if ret < 0:
+            raise self._error('error starting command')
+        self._fd = self._comedi.comedi_fileno(self.device)
+        self._loop.add_reader(self._fd, self._on_readable)
+        self._reading = True
+
+    def _on_readable(self):
+        # Read whole scans straight into a new buffer, after the partial
+        # scan left over from the previous read.  The buffer is handed
+        # to the transports, which may still hold it after this returns,
+        # so it is never reused.
+        buf = bytearray(self._read_size)
+        view = memoryview(buf)
+        n_pending = len(self._pending)
+        view[:n_pending] = self._pending
+        try:
+            n = _os.readv(self._fd, [view[n_pending:]])
+        except OSError as e:
+            self._finish(StreamError('error reading {}: {}'.format(
+                        self.spec.filename, e)))
+            return
+        if not n:
+            self._finish(None)
+            return
+        n += n_pending
+        n_bytes = n - n % self._scan_bytes
+        self._pending = bytes(view[n_bytes:n])
+        if n_bytes:
+            self._on_data(view[:n_bytes])
+
+    def _finish(self, error):
+        self.stop()
+        self._on_end(error)
+
+    def stop(self):
+        if self._reading:
+            self._loop.remove_reader(self._fd)
+            self._reading = False
+            self._comedi.comedi_cancel(self.device, self.subdevice)
+        if self.device:
+            self._comedi.comedi_close(self.device)
+            self.device = None
+
+
+class Subscriber (object):
+    def __init__(self, transport, physical):
+        self.transport = transport
+        self.physical = physical
+        self.done = _asyncio.Event()
+        self.dropped = 0
+
+    def send(self, header, payload):
+        if self.transport.is_closing():
+            self.done.set()
+            return
+        if self.transport.get_write_buffer_size() > MAX_CLIENT_BACKLOG:
+            self.dropped += 1
+            return
+        self.transport.write(header)
+        if payload:
+            self.transport.write(payload)
+
+
+class Acquisition (object):
+    """Fan the scans of one running command out to its subscribers
+
+    The source passes whole scans to `_on_data()`.
+    """
+    def __init__(self, spec, source, on_finished):
+        self.spec = spec
+        self.source = source
+        self.subscribers = set()
+        self._on_finished = on_finished
+        self._n_chan = len(spec.chanlist)
+        self._scan_bytes = (
+            _array.array(source.typecode).itemsize * self._n_chan)
+        self._next_scan = 0
+        self._finished = False
+        self._polynomials = source.polynomials
+        if _numpy is not None:
+            # coefficients[k][i] is the k-th coefficient for channel i
+            order = max(len(c) for c,origin in self._polynomials)
+            self._coefficients = _numpy.zeros((order, self._n_chan))
+            for i,(coefficients, origin) in enumerate(self._polynomials):
+                self._coefficients[:len(coefficients), i] = coefficients
+            self._origins = _numpy.array(
+                [origin for c,origin in self._polynomials])
+
+    def header(self):
+        return {
+            'status': 'ok',
+            'version': PROTOCOL_VERSION,
+            'n_chan': self._n_chan,
+            'scan_rate': self.source.scan_rate,
+            'maxdata': self.source.maxdata,
+            'ranges': [list(r) for r in self.source.ranges],
+            'polynomials': [
+                [list(c), origin] for c,origin in self._polynomials],
+            'raw_typecode': self.source.typecode,
+            'byteorder': _sys.byteorder,
+            }
+
+    def start(self):
+        self.source.start(self._on_data, self._on_end)
+
+    def add(self, subscriber):
+        self.subscribers.add(subscriber)
+
+    def remove(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and not self._finished:
+            LOG.info('last client left {}, stopping'.format(self.spec))
+            self.source.stop()
+            self._finish()
+
+    def _physical(self, payload):
+        """Convert a frame of raw scans to a buffer of doubles
+        """
+        if _numpy is not None:
+            x = _numpy.frombuffer(payload, dtype=self.source.typecode)
+            x = x.reshape(-1, self._n_chan) - self._origins
+            # Horner's rule, one channel per column
+            phys = _numpy.array(self._coefficients[-1], ndmin=2)
+            for coefficients in self._coefficients[-2::-1]:
+                phys = phys * x + coefficients
+            return _numpy.broadcast_to(phys, x.shape).tobytes()
+        raw = _array.array(self.source.typecode)
+        raw.frombytes(payload)
+        n = self._n_chan
+        phys = _array.array('d', bytes(8 * len(raw)))
+        for i,(coefficients, origin) in enumerate(self._polynomials):
+            if len(coefficients) == 2 and origin == 0:
+                offset, gain = coefficients
+                values = [offset + gain * x for x in raw[i::n]]
+            else:
+                values = []
+                for x in raw[i::n]:
+                    x -= origin
+                    value = 0.0
+                    for coefficient in reversed(coefficients):
+                        value = value * x + coefficient
+                    values.append(value)
+            phys[i::n] = _array.array('d', values)
+        return phys
+
+    def _on_data(self, data):
+        n_bytes = len(data)
+        n_scans = n_bytes // self._scan_bytes
+        payload = memoryview(data)
+        first_scan = self._next_scan
+        self._next_scan += n_scans
+
+        raw_header = FRAME_HEADER.pack(
+            MAGIC, PROTOCOL_VERSION, 0, first_scan, n_scans, n_bytes)
+        phys = phys_header = None
+        for subscriber in list(self.subscribers):
+            if subscriber.physical:
+                if phys is None:
+                    phys = memoryview(self._physical(payload)).cast('B')
+                    phys_header = FRAME_HEADER.pack(
+                        MAGIC, PROTOCOL_VERSION, FLAG_PHYSICAL, first_scan,
+                        n_scans, len(phys))
+                subscriber.send(phys_header, phys)
+            else:
+                subscriber.send(raw_header, payload)
+
+    def _on_end(self, error, level=_logging.ERROR):
+        if error is None:
+            flags = FLAG_END
+            message = b''
+        else:
+            LOG.log(level, str(error))
+            flags = FLAG_END | FLAG_ERROR
+            message = str(error).encode('utf-8')
+        header = FRAME_HEADER.pack(
+            MAGIC, PROTOCOL_VERSION, flags, self._next_scan, 0, len(message))
+        for subscriber in list(self.subscribers):
+            subscriber.send(header, message)
+            subscriber.done.set()
+        self._finish()
+
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            self._on_finished(self)
+
+
+class StreamServer (object):
+    """Serve acquisitions from the devices in `filenames`
+
+    Each client sends one JSON line with the fields of `CommandSpec`.
+    The server answers with one JSON line, either
+    `{"status": "error", "message": ...}` or the `Acquisition.header()`
+    of the acquisition the client was attached to, and then streams
+    frames until the acquisition ends or the client disconnects.
+    """
+    def __init__(self, filenames, simulate=False, loop=None):
+        self.filenames = set(filenames)
+        self.simulate = simulate
+        self._loop = loop
+        self._acquisitions = {}
+        self._servers = []
+        self._writers = set()
+        self._handlers = set()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = _asyncio.get_event_loop()
+        return self._loop
+
+    async def start_tcp(self, host, port):
+        server = await _asyncio.start_server(self._handle_client, host, port)
+        self._servers.append(server)
+        return server
+
+    async def start_unix(self, path):
+        server = await _asyncio.start_unix_server(self._handle_client, path)
+        self._servers.append(server)
+        return server
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+        for acquisition in list(self._acquisitions.values()):
+            acquisition.source.stop()
+            acquisition._on_end(
+                StreamError('server shutting down'), level=_logging.INFO)
+        for writer in list(self._writers):
+            writer.close()
+
+    async def wait_closed(self):
+        for server in self._servers:
+            await server.wait_closed()
+        if self._handlers:
+            await _asyncio.wait(list(self._handlers))
+
+    def _acquisition(self, spec):
+        if spec.filename not in self.filenames:
+            raise StreamError('device {} is not served'.format(
+                    spec.filename))
+        acquisition = self._acquisitions.get(spec.filename)
+        if acquisition is not None:
+            # a late client of a finite acquisition would miss its start
+            if (spec.n_scans is not None or
+                    acquisition.spec.key() != spec.key()):
+                raise StreamError('device {} is busy with {}'.format(
+                        spec.filename, acquisition.spec))
+            return acquisition
+        if self.simulate:
+            source = SimulatedSource(spec, self.loop)
+        else:
+            source = ComediSource(spec, self.loop)
+        acquisition = Acquisition(spec, source, self._on_finished)
+        try:
+            acquisition.start()
+        except Exception:
+            source.stop()
+            raise
+        self._acquisitions[spec.filename] = acquisition
+        return acquisition
+
+    def _on_finished(self, acquisition):
+        if self._acquisitions.get(acquisition.spec.filename) is acquisition:
+            del self._acquisitions[acquisition.spec.filename]
+
+    async def _handle_client(self, reader, writer):
+        task = _asyncio.current_task()
+        self._handlers.add(task)
+        self._writers.add(writer)
+        try:
+            await self._serve_client(reader, writer)
+        except _asyncio.CancelledError:
+            # the server is shutting down
+            writer.close()
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(task)
+
+    async def _serve_client(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        try:
+            line = await reader.readline()
+            spec = CommandSpec.from_dict(_json.loads(line.decode('utf-8')))
+            acquisition = self._acquisition(spec)
+        except (ValueError, StreamError) as e:
+            LOG.warning('rejecting {}: {}'.format(peer, e))
+            message = str(e)
+        except Exception as e:
+            # e.g. a missing Comedi binding or a SWIG TypeError
+            LOG.exception('error serving {}'.format(peer))
+            message = '{}: {}'.format(type(e).__name__, e)
+        else:
+            message = None
+        if message is not None:
+            writer.write(_json.dumps(
+                    {'status': 'error', 'message': message}).encode('utf-8'))
+            writer.write(b'\n')
+            writer.close()
+            return
+        LOG.info('streaming {} to {}'.format(spec, peer))
+        header = acquisition.header()
+        writer.write(_json.dumps(header).encode('utf-8') + b'\n')
+        subscriber = Subscriber(writer.transport, spec.physical)
+        acquisition.add(subscriber)
+        # the client sends nothing more, so EOF means it went away
+        eof = _asyncio.ensure_future(reader.read())
+        done = _asyncio.ensure_future(subscriber.done.wait())
+        try:
+            await _asyncio.wait(
+                [eof, done], return_when=_asyncio.FIRST_COMPLETED)
+        finally:
+            eof.cancel()
+            done.cancel()
+            acquisition.remove(subscriber)
+            if subscriber.dropped:
+                LOG.warning('dropped {} frames for slow client {}'.format(
+                        subscriber.dropped, peer))
+            if subscriber.done.is_set():
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+            writer.close()
+
+
+Frame = _collections.namedtuple('Frame', ['first_scan', 'n_scans', 'data'])
+
+
+class StreamClient (object):
+    """Receive the frames of one acquisition from a `StreamServer`
+
+    Use `open_tcp()` or `open_unix()` to connect, then iterate with
+    `async for frame in client` or call `read_frame()`.  Each `Frame`
+    holds the sequence number of its first scan, the number of scans
+    and an `array.array` of samples in scan order, so channel `i` is
+    `frame.data[i::client.n_chan]`.
+    """
+    def __init__(self, reader, writer, header):
+        self._reader = reader
+        self._writer = writer
+        self.header = header
+        self.n_chan = header['n_chan']
+        self.scan_rate = header['scan_rate']
+        self._swap = header['byteorder'] != _sys.byteorder
+        self.next_scan = None
+        self.lost_scans = 0
+
+    @classmethod
+    async def _open(cls, reader, writer, spec):
+        writer.write(_json.dumps(spec.to_dict()).encode('utf-8') + b'\n')
+        line = await reader.readline()
+        if not line:
+            writer.close()
+            raise StreamError('server closed the connection')
+        header = _json.loads(line.decode('utf-8'))
+        if header.get('status') != 'ok':
+            writer.close()
+            raise StreamError(header.get('message', 'unknown error'))
+        return cls(reader, writer, header)
+
+    @classmethod
+    async def open_tcp(cls, host, port, spec):
+        reader, writer = await _asyncio.open_connection(host, port)
+        return await cls._open(reader, writer, spec)
+
+    @classmethod
+    async def open_unix(cls, path, spec):
+        reader, writer = await _asyncio.open_unix_connection(path)
+        return await cls._open(reader, writer, spec)
+
+    async def read_frame(self):
+        """Return the next `Frame`, or `None` once the acquisition ended
+        """
+        try:
+            header = await self._reader.readexactly(FRAME_HEADER.size)
+        except _asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise StreamError('truncated frame header')
+            return None
+        magic, version, flags, first_scan, n_scans, n_bytes = (
+            FRAME_HEADER.unpack(header))
+        if magic != MAGIC or version != PROTOCOL_VERSION:
+            raise StreamError('invalid frame header')
+        payload = await self._reader.readexactly(n_bytes)
+        if flags & FLAG_END:
+            if flags & FLAG_ERROR:
+                raise StreamError(payload.decode('utf-8'))
+            return None
+        if flags & FLAG_PHYSICAL:
+            data = _array.array('d')
+        else:
+            data = _array.array(self.header['raw_typecode'])
+        data.frombytes(payload)
+        if self._swap:
+            data.byteswap()
+        # a client joining a running acquisition starts mid-stream
+        if self.next_scan is not None and first_scan != self.next_scan:
+            self.lost_scans += first_scan - self.next_scan
+        self.next_scan = first_scan + n_scans
+        return Frame(first_scan, n_scans, data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.read_frame()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    def close(self):
+        self._writer.close()
+
+
+def read_scans(spec, host=None, port=None, path=None):
+    """Acquire `spec.n_scans` scans and return them in one array
+
+    Connects over TCP if `host` and `port` are given, otherwise over the
+    Unix socket at `path`.  Frames dropped by the server leave gaps,
+    which `read_scans()` does not try to fill.
+    """
+    if spec.n_scans is None:
+        raise StreamError('read_scans() needs a finite number of scans')
+
+    async def run():
+        if path is None:
+            client = await StreamClient.open_tcp(host, port, spec)
+        else:
+            client = await StreamClient.open_unix(path, spec)
+        data = None
+        try:
+            async for frame in client:
+                if data is None:
+                    data = frame.data
+                else:
+                    data.extend(frame.data)
+        finally:
+            client.close()
+        return data
+
+    return _asyncio.run(run())
+
+
+def _parse_chanlist(channels, rng, aref):
+    return [(channel, rng, aref) for channel in channels]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '-v', '--verbose', default=0, action='count')
+    subparsers = parser.add_subparsers(dest='action')
+    subparsers.required = True
+
+    serve = subparsers.add_parser('serve', help='run the streaming server')
+    serve.add_argument(
+        '-f', '--filename', dest='filenames', action='append',
+        help='path to a comedi device file to serve (repeatable)')
+    serve.add_argument(
+        '-H', '--host', default='127.0.0.1', help='address to listen on')
+    serve.add_argument(
+        '-p', '--port', type=int, help='TCP port to listen on')
+    serve.add_argument(
+        '-u', '--unix', help='Unix socket path to listen on')
+    serve.add_argument(
+        '--simulate', action='store_true',
+        help='serve a synthetic device instead of real hardware')
+
+    read = subparsers.add_parser('read', help='print streamed scans')
+    read.add_argument(
+        '-f', '--filename', default='/dev/comedi0',
+        help='path to comedi device file on the server')
+    read.add_argument(
+        '-H', '--host', default='127.0.0.1', help='server address')
+    read.add_argument(
+        '-p', '--port', type=int, help='server TCP port')
+    read.add_argument(
+        '-u', '--unix', help='server Unix socket path')
+    read.add_argument(
+        '-s', '--subdevice', type=int, help='subdevice for analog input')
+    read.add_argument(
+        '-c', '--channels', type=int, nargs='+', default=[0],
+        help='channels for analog input')
+    read.add_argument(
+        '-r', '--range', type=int, default=0, help='range for analog input')
+    read.add_argument(
+        '-a', '--aref', type=int, default=0,
+        help='analog reference (AREF_GROUND is 0)')
+    read.add_argument(
+        '-F', '--frequency', type=float, default=1000.0,
+        help='scan rate in Hz')
+    read.add_argument(
+        '-N', '--num-scans', type=int, default=1000,
+        help='number of scans')
+    read.add_argument(
+        '--physical', action='store_true',
+        help='request samples in physical units')
+
+    args = parser.parse_args()
+
+    if args.verbose >= 2:
+        LOG.setLevel(_logging.DEBUG)
+    elif args.verbose >= 1:
+        LOG.setLevel(_logging.INFO)
+
+    if args.action == 'serve':
+        if args.port is None and args.unix is None:
+            parser.error('serve needs --port and/or --unix')
+        server = StreamServer(
+            args.filenames or ['/dev/comedi0'], simulate=args.simulate)
+
+        async def serve_forever():
+            if args.port is not None:
+                await server.start_tcp(args.host, args.port)
+            if args.unix is not None:
+                await server.start_unix(args.unix)
+            try:
+                await _asyncio.Event().wait()
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        try:
+            _asyncio.run(serve_forever())
+        except KeyboardInterrupt:
+            pass
+    else:
+        if args.port is None and args.unix is None:
+            parser.error('read needs --port or --unix')
+        spec = CommandSpec(
+            chanlist=_parse_chanlist(args.channels, args.range, args.aref),
+            rate=args.frequency, n_scans=args.num_scans,
+            physical=args.physical, filename=args.filename,
+            subdevice=args.subdevice)
+        data = read_scans(
+            spec, host=args.host, port=args.port, path=args.unix)
+        n_chan = len(args.channels)
+        for i in range(0, len(data or []), n_chan):
+            print(' '.join(str(x) for x in data[i:i + n_chan]))
@@ -16,4 +16,4 @@ setup (name='comedi',
 	author_email = 'bryan.cole@teraview.co.uk',
 	long_description = ''' Wrapper for the Comedi data-acquisition library ''',
 	ext_modules = [module1],
-	py_modules = ['comedi'])
+	py_modules = ['comedi', 'comedi_stream'])
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Loopback checks for `comedi_stream` against the simulated device
+
+Runs a `StreamServer` with `--simulate` semantics in a background
+thread and talks to it over TCP and a Unix socket.  No Comedi device
+or binding is needed.
+"""
+
+import array as _array
+import asyncio as _asyncio
+import os as _os
+import tempfile as _tempfile
+import threading as _threading
+import unittest as _unittest
+
+import comedi_stream as _cs
+
+
+CHANLIST = [(0, 0, 0), (1, 0, 0)]
+TIMEOUT = 5
+
+
+class LoopbackTest (_unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = _tempfile.mkdtemp()
+        self.path = _os.path.join(self.tmpdir, 'stream.sock')
+        self.loop = _asyncio.new_event_loop()
+        self.server = _cs.StreamServer(
+            ['/dev/comedi0'], simulate=True, loop=self.loop)
+        started = _threading.Event()
+
+        def run():
+            _asyncio.set_event_loop(self.loop)
+            tcp = self.loop.run_until_complete(
+                self.server.start_tcp('127.0.0.1', 0))
+            self.port = tcp.sockets[0].getsockname()[1]
+            self.loop.run_until_complete(self.server.start_unix(self.path))
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = _threading.Thread(target=run)
+        self.thread.start()
+        started.wait()
+
+    def tearDown(self):
+        async def stop():
+            self.server.close()
+            await self.server.wait_closed()
+            self.loop.stop()
+        _asyncio.run_coroutine_threadsafe(stop(), self.loop)
+        self.thread.join()
+        self.loop.close()
+        _os.unlink(self.path)
+        _os.rmdir(self.tmpdir)
+
+    def spec(self, **kwargs):
+        return _cs.CommandSpec(CHANLIST, rate=2000, **kwargs)
+
+    def test_raw_tcp(self):
+        data = _cs.read_scans(
+            self.spec(n_scans=300), host='127.0.0.1', port=self.port)
+        self.assertEqual(data.typecode, 'H')
+        self.assertEqual(len(data), 300 * len(CHANLIST))
+        # the simulated sines start at mid-scale
+        self.assertEqual(data[0], int(0.5 * 0xffff))
+
+    def test_physical_unix(self):
+        data = _cs.read_scans(self.spec(n_scans=300, physical=True),
+                              path=self.path)
+        self.assertEqual(data.typecode, 'd')
+        self.assertEqual(len(data), 300 * len(CHANLIST))
+        self.assertTrue(all(-10 <= x <= 10 for x in data))
+
+    def test_sequence_numbers(self):
+        async def run():
+            client = await _cs.StreamClient.open_tcp(
+                '127.0.0.1', self.port, self.spec(n_scans=500))
+            frames = [frame async for frame in client]
+            client.close()
+            return client, frames
+
+        client, frames = _asyncio.run(run())
+        self.assertEqual(frames[0].first_scan, 0)
+        for previous,frame in zip(frames, frames[1:]):
+            self.assertEqual(
+                frame.first_scan, previous.first_scan + previous.n_scans)
+        self.assertEqual(client.next_scan, 500)
+        self.assertEqual(client.lost_scans, 0)
+
+    def test_shared_continuous(self):
+        async def run():
+            raw = await _cs.StreamClient.open_tcp(
+                '127.0.0.1', self.port, self.spec())
+            first = await raw.read_frame()
+            await _asyncio.sleep(0.1)
+            phys = await _cs.StreamClient.open_unix(
+                self.path, self.spec(physical=True))
+            late = await phys.read_frame()
+            raw_frames = [await raw.read_frame() for i in range(3)]
+            phys_frames = [await phys.read_frame() for i in range(3)]
+            raw.close()
+            phys.close()
+            return first, late, raw_frames, phys_frames, raw, phys
+
+        first, late, raw_frames, phys_frames, raw, phys = _asyncio.run(run())
+        self.assertEqual(first.first_scan, 0)
+        self.assertGreater(late.first_scan, 0)
+        self.assertEqual(raw.lost_scans, 0)
+        self.assertEqual(phys.lost_scans, 0)
+        self.assertEqual(raw_frames[-1].data.typecode, 'H')
+        self.assertEqual(phys_frames[-1].data.typecode, 'd')
+
+    def test_finite_not_shared(self):
+        async def run():
+            first = await _cs.StreamClient.open_tcp(
+                '127.0.0.1', self.port, self.spec(n_scans=400))
+            await first.read_frame()
+            try:
+                with self.assertRaisesRegex(_cs.StreamError, 'busy'):
+                    await _cs.StreamClient.open_tcp(
+                        '127.0.0.1', self.port, self.spec(n_scans=400))
+            finally:
+                first.close()
+
+        _asyncio.run(run())
+
+    def test_invalid_rate(self):
+        for rate in ['nan', 'inf', 0]:
+            with self.assertRaises(_cs.StreamError):
+                _cs.CommandSpec(CHANLIST, rate=rate)
+
+    def test_failed_start_not_registered(self):
+        start = _cs.SimulatedSource.start
+
+        def fail(source, on_data, on_end):
+            raise _cs.StreamError('start failed')
+
+        _cs.SimulatedSource.start = fail
+        try:
+            with self.assertRaisesRegex(_cs.StreamError, 'start failed'):
+                _cs.read_scans(self.spec(n_scans=100), path=self.path)
+        finally:
+            _cs.SimulatedSource.start = start
+
+        async def run():
+            client = await _cs.StreamClient.open_unix(
+                self.path, self.spec(n_scans=100))
+            frames = [frame async for frame in client]
+            client.close()
+            return frames
+
+        # a dead acquisition left registered would stall this client
+        frames = _asyncio.run(_asyncio.wait_for(run(), TIMEOUT))
+        self.assertEqual(sum(frame.n_scans for frame in frames), 100)
+
+    def test_unexpected_error_reply(self):
+        start = _cs.SimulatedSource.start
+
+        def fail(source, on_data, on_end):
+            raise TypeError('bad argument')
+
+        _cs.SimulatedSource.start = fail
+        try:
+            with self.assertRaisesRegex(_cs.StreamError, 'TypeError'):
+                _cs.read_scans(self.spec(n_scans=100), path=self.path)
+        finally:
+            _cs.SimulatedSource.start = start
+
+
+class ConversionTest (_unittest.TestCase):
+    def acquisition(self, polynomials):
+        source = _cs.SimulatedSource(
+            _cs.CommandSpec(CHANLIST, rate=1000), loop=None)
+        source.polynomials = polynomials
+        return _cs.Acquisition(source.spec, source, lambda a: None)
+
+    def check_physical(self):
+        polynomials = [((-10.0, 20.0 / 0xffff), 0.0),
+                       ((0.5, 1e-3, 2e-7, -1e-12), 100.0)]
+        acquisition = self.acquisition(polynomials)
+        raw = _array.array('H', [0, 100, 0x8000, 0x8000, 0xffff, 0xffff])
+        phys = _array.array('d')
+        phys.frombytes(bytes(acquisition._physical(raw.tobytes())))
+        for j,x in enumerate(raw):
+            coefficients, origin = polynomials[j % len(CHANLIST)]
+            expected = sum(c * (x - origin) ** k
+                           for k,c in enumerate(coefficients))
+            self.assertAlmostEqual(phys[j], expected)
+
+    def test_physical(self):
+        self.check_physical()
+
+    def test_physical_pure_python(self):
+        numpy = _cs._numpy
+        _cs._numpy = None
+        try:
+            self.check_physical()
+        finally:
+            _cs._numpy = numpy
+
+    def test_partial_scans(self):
+        # drive ComediSource's reader with a pipe instead of a device
+        source = _cs.ComediSource.__new__(_cs.ComediSource)
+        source.spec = _cs.CommandSpec(CHANLIST, rate=1000)
+        source.device = None
+        source._reading = False
+        source._pending = b''
+        source._scan_bytes = 4
+        source._read_size = 16
+        frames = []
+        ended = []
+        source._on_data = lambda data: frames.append(bytes(data))
+        source._on_end = ended.append
+        r, w = _os.pipe()
+        source._fd = r
+        try:
+            for chunk in [b'abcdef', b'gh', b'i', b'jklmnopqrstuvwxyz']:
+                _os.write(w, chunk)
+                source._on_readable()
+            _os.close(w)
+            w = None
+            # the trailing partial scan is dropped at EOF
+            source._on_readable()
+            source._on_readable()
+        finally:
+            _os.close(r)
+            if w is not None:
+                _os.close(w)
+        self.assertEqual(frames, [b'abcd', b'efgh', b'ijklmnopqrstuvwx'])
+        self.assertEqual(ended, [None])
+
+
+if __name__ == '__main__':
+    _unittest.main()
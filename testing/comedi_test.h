@@ -13,5 +13,19 @@ extern unsigned int capabilities;
 
 extern int realtime;
 
+/* insn_latency options */
+extern unsigned int latency_iterations;
+extern unsigned int latency_batch;
+extern unsigned int latency_period_us;
+extern int latency_fifo_priority;
+extern int latency_cpu;
+extern unsigned int latency_range;
+extern unsigned int latency_aref;
+extern char *latency_channels;
+extern int latency_write_subdevice;
+extern unsigned int latency_write_channel;
+extern unsigned int latency_write_range;
+extern unsigned int latency_write_aref;
+
 #endif
 
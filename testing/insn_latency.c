@@ -0,0 +1,457 @@
+#define _GNU_SOURCE
+
+#include <stdio.h>
+#include <comedilib.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/ioctl.h>
+#include <sys/mman.h>
+#include <errno.h>
+#include <getopt.h>
+#include <ctype.h>
+#include <math.h>
+#include <sched.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include "comedi_test.h"
+
+/*
+ * Log-linear histogram in the style of HdrHistogram.  Values below
+ * 2*HIST_HALF are counted exactly; above that, each power of two is
+ * split into HIST_HALF buckets, giving about 3% resolution.
+ */
+#define HIST_SUB_BUCKET_BITS	6
+#define HIST_HALF		(1 << (HIST_SUB_BUCKET_BITS - 1))
+#define HIST_N_BUCKETS		((64 - HIST_SUB_BUCKET_BITS + 2) * HIST_HALF)
+
+struct histogram{
+	const char *name;
+	unsigned long count[HIST_N_BUCKETS];
+	unsigned long total;
+	uint64_t min;
+	uint64_t max;
+	double sum;
+	double sumsq;
+};
+
+struct latency_sample{
+	uint64_t user_start;	/* CLOCK_MONOTONIC, ns */
+	uint64_t user_end;
+	uint64_t kernel_start;	/* INSN_GTOD, us */
+	uint64_t kernel_end;
+	uint64_t wakeup;	/* ns late for the scheduled start */
+};
+
+static const double percentiles[] = { 50.0, 90.0, 99.0, 99.9, 99.99 };
+
+static unsigned int hist_index(uint64_t value)
+{
+	unsigned int shift;
+
+	if(value < 2 * HIST_HALF)
+		return value;
+	shift = 63 - __builtin_clzll(value) - (HIST_SUB_BUCKET_BITS - 1);
+	return (shift + 1) * HIST_HALF + (value >> shift) - HIST_HALF;
+}
+
+static uint64_t hist_lowest(unsigned int index)
+{
+	unsigned int shift;
+
+	if(index < 2 * HIST_HALF)
+		return index;
+	shift = index / HIST_HALF - 1;
+	return (uint64_t)(index % HIST_HALF + HIST_HALF) << shift;
+}
+
+static uint64_t hist_highest(unsigned int index)
+{
+	if(index + 1 >= HIST_N_BUCKETS)
+		return UINT64_MAX;
+	return hist_lowest(index + 1) - 1;
+}
+
+static void hist_init(struct histogram *h, const char *name)
+{
+	memset(h, 0, sizeof(*h));
+	h->name = name;
+	h->min = UINT64_MAX;
+}
+
+static void hist_record(struct histogram *h, uint64_t value)
+{
+	h->count[hist_index(value)]++;
+	h->total++;
+	if(value < h->min) h->min = value;
+	if(value > h->max) h->max = value;
+	h->sum += value;
+	h->sumsq += (double)value * value;
+}
+
+static uint64_t hist_percentile(const struct histogram *h, double percentile)
+{
+	unsigned long target;
+	unsigned long seen = 0;
+	unsigned int i;
+
+	target = ceil(percentile / 100.0 * h->total);
+	if(target < 1) target = 1;
+	for(i = 0; i < HIST_N_BUCKETS; i++){
+		seen += h->count[i];
+		if(seen >= target){
+			uint64_t value = hist_highest(i);
+
+			return value < h->max ? value : h->max;
+		}
+	}
+	return h->max;
+}
+
+static void hist_print(const struct histogram *h)
+{
+	double mean;
+	double var;
+	uint64_t value;
+	unsigned long seen = 0;
+	unsigned int i;
+
+	if(h->total == 0)
+		return;
+
+	mean = h->sum / h->total;
+	var = h->total > 1 ?
+		(h->sumsq - h->sum * mean) / (h->total - 1) : 0;
+	if(var < 0) var = 0;
+
+	printf("I: %s (ns): n=%lu min=%llu mean=%.1f stddev=%.1f max=%llu jitter=%llu\n",
+		h->name, h->total, (unsigned long long)h->min, mean, sqrt(var),
+		(unsigned long long)h->max,
+		(unsigned long long)(h->max - h->min));
+	printf("I: %s (ns):", h->name);
+	for(i = 0; i < sizeof(percentiles) / sizeof(percentiles[0]); i++){
+		printf(" p%g=%llu", percentiles[i],
+			(unsigned long long)hist_percentile(h, percentiles[i]));
+	}
+	printf("\n");
+
+	/* HdrHistogram-like percentile distribution */
+	printf("%14s %10s %12s\n", "value_ns", "count", "percentile");
+	for(i = 0; i < HIST_N_BUCKETS; i++){
+		if(h->count[i] == 0)
+			continue;
+		value = hist_highest(i);
+		if(value > h->max) value = h->max;
+		seen += h->count[i];
+		printf("%14llu %10lu %12.6f\n", (unsigned long long)value,
+			h->count[i], 100.0 * seen / h->total);
+	}
+}
+
+static uint64_t monotonic_ns(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
+static void timespec_add_ns(struct timespec *ts, uint64_t ns)
+{
+	ns += ts->tv_nsec;
+	ts->tv_sec += ns / 1000000000;
+	ts->tv_nsec = ns % 1000000000;
+}
+
+struct sched_state{
+	int policy;
+	struct sched_param param;
+	cpu_set_t cpus;
+	int have_cpus;
+};
+
+/*
+ * Parse the comma-separated --channels list into a newly allocated
+ * array.  Without a list, the reads cycle through all channels.
+ */
+static unsigned int *latency_chanlist(unsigned int n_chan, unsigned int *n)
+{
+	unsigned int *chans;
+	const char *p;
+	char *end;
+	unsigned long chan;
+	unsigned int i;
+
+	if(!latency_channels){
+		chans = malloc(n_chan * sizeof(*chans));
+		if(!chans)
+			return NULL;
+		for(i = 0; i < n_chan; i++)
+			chans[i] = i;
+		*n = n_chan;
+		return chans;
+	}
+	*n = 1;
+	for(p = latency_channels; *p; p++)
+		if(*p == ',') (*n)++;
+	chans = malloc(*n * sizeof(*chans));
+	if(!chans)
+		return NULL;
+	p = latency_channels;
+	for(i = 0; i < *n; i++){
+		chan = strtoul(p, &end, 0);
+		if(end == p || (*end != ',' && *end != 0) || chan >= n_chan){
+			printf("E: invalid channel list \"%s\" (%u channels)\n",
+				latency_channels, n_chan);
+			free(chans);
+			return NULL;
+		}
+		chans[i] = chan;
+		p = end + 1;
+	}
+	return chans;
+}
+
+static void latency_sched_setup(struct sched_state *saved)
+{
+	saved->policy = sched_getscheduler(0);
+	sched_getparam(0, &saved->param);
+	saved->have_cpus = sched_getaffinity(0, sizeof(saved->cpus),
+		&saved->cpus) == 0;
+
+	if(latency_cpu >= 0){
+		cpu_set_t cpus;
+
+		CPU_ZERO(&cpus);
+		CPU_SET(latency_cpu, &cpus);
+		if(sched_setaffinity(0, sizeof(cpus), &cpus) < 0){
+			printf("W: sched_setaffinity(cpu %d): %s\n",
+				latency_cpu, strerror(errno));
+		}
+	}
+	if(latency_fifo_priority > 0){
+		struct sched_param param;
+
+		memset(&param, 0, sizeof(param));
+		param.sched_priority = latency_fifo_priority;
+		if(sched_setscheduler(0, SCHED_FIFO, &param) < 0){
+			printf("W: sched_setscheduler(SCHED_FIFO, %d): %s\n",
+				latency_fifo_priority, strerror(errno));
+		}
+		if(mlockall(MCL_CURRENT | MCL_FUTURE) < 0){
+			printf("W: mlockall: %s\n", strerror(errno));
+		}
+	}
+	printf("I: policy=%s priority=%d cpu=%d\n",
+		sched_getscheduler(0) == SCHED_FIFO ? "SCHED_FIFO" : "other",
+		latency_fifo_priority, sched_getcpu());
+}
+
+static void latency_sched_restore(const struct sched_state *saved)
+{
+	if(latency_fifo_priority > 0){
+		munlockall();
+		sched_setscheduler(0, saved->policy, &saved->param);
+	}
+	if(latency_cpu >= 0 && saved->have_cpus)
+		sched_setaffinity(0, sizeof(saved->cpus), &saved->cpus);
+}
+
+int test_insn_latency(void)
+{
+	comedi_insn *insn;
+	comedi_insnlist il;
+	lsampl_t t1[2], t2[2];
+	lsampl_t *data;
+	lsampl_t write_data = 0;
+	unsigned int *chans = NULL;
+	unsigned int n_chans;
+	unsigned int n_insns;
+	size_t samples_size = 0;
+	struct latency_sample *samples;
+	struct histogram *hist;
+	struct sched_state saved;
+	struct timespec next;
+	uint64_t user_start;
+	uint64_t user_end;
+	int n_chan;
+	unsigned int i;
+	unsigned int j;
+	unsigned int n_done = 0;
+	int ret;
+
+	printf("rev 1\n");
+
+	if(comedi_get_subdevice_type(device,subdevice)==COMEDI_SUBD_UNUSED){
+		printf("not applicable\n");
+		return 0;
+	}
+	n_chan = comedi_get_n_channels(device, subdevice);
+	if(n_chan <= 0){
+		printf("not applicable\n");
+		return 0;
+	}
+	if(latency_iterations == 0 || latency_batch == 0){
+		printf("E: need at least one iteration and one instruction\n");
+		return 0;
+	}
+
+	if(latency_write_subdevice >= 0){
+		lsampl_t maxdata;
+
+		maxdata = comedi_get_maxdata(device, latency_write_subdevice,
+			latency_write_channel);
+		if(maxdata == 0){
+			printf("E: write subdevice %d channel %u: %s\n",
+				latency_write_subdevice, latency_write_channel,
+				comedi_strerror(comedi_errno()));
+			return 0;
+		}
+		/* mid-scale, so the output stays put */
+		write_data = maxdata / 2 + 1;
+	}
+
+	n_insns = latency_batch + 2 + (latency_write_subdevice >= 0);
+	insn = calloc(n_insns, sizeof(*insn));
+	data = calloc(latency_batch, sizeof(*data));
+	/*
+	 * Map the samples populated, so no page faults land inside the
+	 * measured loop.  A calloc()ed buffer this size is only faulted
+	 * in as it is written, unless --fifo's mlockall() happens to do
+	 * it, which would skew the comparison with and without --fifo.
+	 */
+	samples_size = latency_iterations * sizeof(*samples);
+	samples = mmap(NULL, samples_size, PROT_READ | PROT_WRITE,
+		MAP_PRIVATE | MAP_ANONYMOUS | MAP_POPULATE, -1, 0);
+	if(samples == MAP_FAILED)
+		samples = NULL;
+	hist = malloc(4 * sizeof(*hist));
+	if(!insn || !data || !samples || !hist){
+		printf("E: out of memory\n");
+		goto out;
+	}
+	chans = latency_chanlist(n_chan, &n_chans);
+	if(!chans)
+		goto out;
+
+	memset(&il,0,sizeof(il));
+	il.n_insns = n_insns;
+	il.insns = insn;
+
+	insn[0].insn = INSN_GTOD;
+	insn[0].n = 2;
+	insn[0].data = t1;
+
+	for(i = 0; i < latency_batch; i++){
+		insn[i + 1].subdev = subdevice;
+		insn[i + 1].insn = INSN_READ;
+		insn[i + 1].n = 1;
+		insn[i + 1].chanspec = CR_PACK(chans[i % n_chans],
+			latency_range, latency_aref);
+		insn[i + 1].data = data + i;
+	}
+
+	if(latency_write_subdevice >= 0){
+		insn[n_insns - 2].subdev = latency_write_subdevice;
+		insn[n_insns - 2].insn = INSN_WRITE;
+		insn[n_insns - 2].n = 1;
+		insn[n_insns - 2].chanspec = CR_PACK(latency_write_channel,
+			latency_write_range, latency_write_aref);
+		insn[n_insns - 2].data = &write_data;
+	}
+
+	insn[n_insns - 1].insn = INSN_GTOD;
+	insn[n_insns - 1].n = 2;
+	insn[n_insns - 1].data = t2;
+
+	printf("I: %u iterations of %u INSN_READ (range %u, aref %u)%s, period %u us\n",
+		latency_iterations, latency_batch, latency_range, latency_aref,
+		latency_write_subdevice >= 0 ? " and 1 INSN_WRITE" : "",
+		latency_period_us);
+
+	latency_sched_setup(&saved);
+
+	/* warm up caches and the driver before measuring */
+	ret = comedi_do_insnlist(device, &il);
+	if(ret < (int)il.n_insns){
+		printf("not applicable: comedi_do_insnlist returned %d (expected %u): %s\n",
+			ret, il.n_insns, comedi_strerror(comedi_errno()));
+		latency_sched_restore(&saved);
+		goto out;
+	}
+
+	clock_gettime(CLOCK_MONOTONIC, &next);
+	for(i = 0; i < latency_iterations; i++){
+		struct latency_sample *s = samples + i;
+
+		if(latency_period_us){
+			timespec_add_ns(&next, latency_period_us * 1000ULL);
+			clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &next,
+				NULL);
+		}
+		/* store into samples only after the second timestamp */
+		user_start = monotonic_ns();
+		ret = comedi_do_insnlist(device, &il);
+		user_end = monotonic_ns();
+		if(ret < (int)il.n_insns){
+			printf("E: comedi_do_insnlist: returned %d (expected %u): %s\n",
+				ret, il.n_insns, comedi_strerror(comedi_errno()));
+			break;
+		}
+		s->user_start = user_start;
+		s->user_end = user_end;
+		s->kernel_start = (uint64_t)t1[0] * 1000000 + t1[1];
+		s->kernel_end = (uint64_t)t2[0] * 1000000 + t2[1];
+		if(latency_period_us){
+			uint64_t scheduled = (uint64_t)next.tv_sec * 1000000000 +
+				next.tv_nsec;
+
+			s->wakeup = user_start > scheduled ?
+				user_start - scheduled : 0;
+		}
+		n_done++;
+	}
+
+	latency_sched_restore(&saved);
+
+	hist_init(&hist[0], "round trip");
+	hist_init(&hist[1], "driver");
+	hist_init(&hist[2], "syscall overhead");
+	hist_init(&hist[3], "wakeup latency");
+	for(i = 0; i < n_done; i++){
+		struct latency_sample *s = samples + i;
+		uint64_t round_trip = s->user_end - s->user_start;
+		uint64_t driver = 0;
+
+		/* INSN_GTOD uses the wall clock, which may step */
+		if(s->kernel_end >= s->kernel_start)
+			driver = (s->kernel_end - s->kernel_start) * 1000;
+		hist_record(&hist[0], round_trip);
+		hist_record(&hist[1], driver);
+		hist_record(&hist[2],
+			round_trip > driver ? round_trip - driver : 0);
+		if(latency_period_us)
+			hist_record(&hist[3], s->wakeup);
+		if(verbose){
+			printf("%u %llu %llu %llu %llu\n", i,
+				(unsigned long long)s->user_start,
+				(unsigned long long)s->user_end,
+				(unsigned long long)s->kernel_start,
+				(unsigned long long)s->kernel_end);
+		}
+	}
+	printf("I: driver time has INSN_GTOD (microsecond) resolution\n");
+	for(j = 0; j < 4; j++)
+		hist_print(&hist[j]);
+
+out:
+	free(chans);
+	free(hist);
+	if(samples)
+		munmap(samples, samples_size);
+	free(data);
+	free(insn);
+
+	return 0;
+}
@@ -29,6 +29,7 @@ int test_mode0_read(void);
 int test_insn_read(void);
 int test_insn_read_0(void);
 int test_insn_read_time(void);
+int test_insn_latency(void);
 int test_cmd_no_cmd(void);
 int test_cmd_probe_src_mask(void);
 int test_cmd_probe_fast_1chan(void);
@@ -56,6 +57,7 @@ struct test_struct tests[]={
 	{ "insn_read", test_insn_read, TEST_STD },
 	{ "insn_read_0", test_insn_read_0, TEST_STD },
 	{ "insn_read_time", test_insn_read_time, TEST_STD },
+	{ "insn_latency", test_insn_latency, TEST_NEVER },
 	{ "cmd_no_cmd", test_cmd_no_cmd, TEST_STD },
 	{ "cmd_probe_src_mask", test_cmd_probe_src_mask, TEST_STD },
 	{ "cmd_probe_fast_1chan", test_cmd_probe_fast_1chan, TEST_STD },
@@ -76,6 +78,19 @@ int verbose;
 char *only_test;
 int realtime;
 
+unsigned int latency_iterations = 10000;
+unsigned int latency_batch = 1;
+unsigned int latency_period_us;
+int latency_fifo_priority;
+int latency_cpu = -1;
+unsigned int latency_range;
+unsigned int latency_aref;
+char *latency_channels;
+int latency_write_subdevice = -1;
+unsigned int latency_write_channel;
+unsigned int latency_write_range;
+unsigned int latency_write_aref;
+
 static void get_capabilities(unsigned int subd);
 static void print_device_info(void);
 
@@ -91,6 +106,17 @@ void help(int ret)
 "  --test, -t <test>            Only run test <test>\n"
 "  --verbose, -v                Be verbose\n"
 "  --help, -h                   Print this message\n"
+"Options for the insn_latency test:\n"
+"  --iterations, -n <count>     Number of instruction lists to run\n"
+"  --batch, -b <count>          Number of INSN_READs per instruction list\n"
+"  --channels, -C <list>        Comma-separated channels to read in turn\n"
+"  --range, -R <range>          Range of the INSN_READs\n"
+"  --aref, -a <aref>            Analog reference of the INSN_READs\n"
+"  --write, -w <subd>[,<chan>[,<range>[,<aref>]]]\n"
+"                               End each list with an INSN_WRITE\n"
+"  --period, -P <us>            Start an instruction list every <us> us\n"
+"  --fifo, -p <priority>        Run under SCHED_FIFO at <priority>\n"
+"  --cpu, -c <cpu>              Pin to CPU <cpu>\n"
 "Available tests: ");
 	for(i=0;i<n_tests;i++){
 		fprintf(stderr,"%s ",tests[i].name);
@@ -107,6 +133,15 @@ static struct option longopts[]={
 	{ "test", 1, 0, 't' },
 	{ "verbose", 0, 0, 'v' },
 	{ "help", 0, 0, 'h' },
+	{ "iterations", 1, 0, 'n' },
+	{ "batch", 1, 0, 'b' },
+	{ "period", 1, 0, 'P' },
+	{ "fifo", 1, 0, 'p' },
+	{ "cpu", 1, 0, 'c' },
+	{ "channels", 1, 0, 'C' },
+	{ "range", 1, 0, 'R' },
+	{ "aref", 1, 0, 'a' },
+	{ "write", 1, 0, 'w' },
 	{0}
 };
 
@@ -118,7 +153,7 @@ int main(int argc, char *argv[])
 	setvbuf(stdout,NULL,_IONBF,0);
 
 	while (1) {
-		c = getopt_long(argc, argv, "f:rs:t:v", longopts, NULL);
+		c = getopt_long(argc, argv, "f:rs:t:vn:b:P:p:c:C:R:a:w:", longopts, NULL);
 		if (c == -1)
 			break;
 		switch (c) {
@@ -141,6 +176,35 @@ int main(int argc, char *argv[])
 		case 'v':
 			verbose = 1;
 			break;
+		case 'n':
+			sscanf(optarg,"%u",&latency_iterations);
+			break;
+		case 'b':
+			sscanf(optarg,"%u",&latency_batch);
+			break;
+		case 'P':
+			sscanf(optarg,"%u",&latency_period_us);
+			break;
+		case 'p':
+			sscanf(optarg,"%d",&latency_fifo_priority);
+			break;
+		case 'c':
+			sscanf(optarg,"%d",&latency_cpu);
+			break;
+		case 'C':
+			latency_channels = optarg;
+			break;
+		case 'R':
+			sscanf(optarg,"%u",&latency_range);
+			break;
+		case 'a':
+			sscanf(optarg,"%u",&latency_aref);
+			break;
+		case 'w':
+			sscanf(optarg,"%d,%u,%u,%u",&latency_write_subdevice,
+				&latency_write_channel,&latency_write_range,
+				&latency_write_aref);
+			break;
 		default:
 			help(1);
 			break;